@@ -538,13 +538,14 @@ class NamespaceWrapper(DecoratedWrapper):
         lambda self, value : None)
 
     def _key_decorator(self, key):
+        # Single-key methods below build this inline, saves a call per operation
         return (self.namespace, self.revision, key)
 
     def getTtl(self, key, default = NONE, **kw):
-        return self.client.getTtl(self._key_decorator(key), default, **kw)
+        return self.client.getTtl((self.namespace, self.revision, key), default, **kw)
 
     def get(self, key, default = NONE, **kw):
-        return self.client.get(self._key_decorator(key), default, **kw)
+        return self.client.get((self.namespace, self.revision, key), default, **kw)
 
     def getTtlMulti(self, keys, default = NONE, **kw):
         # Specialized implementation of DecoratedWrapper
@@ -569,7 +570,24 @@ class NamespaceWrapper(DecoratedWrapper):
             yield key_undecorator(gkey), rv
 
     def contains(self, key, ttl = None, **kw):
-        return self.client.contains(self._key_decorator(key), ttl, **kw)
+        return self.client.contains((self.namespace, self.revision, key), ttl, **kw)
+
+    # Specialized implementations of DecoratedWrapper, namespaces don't
+    # decorate values, so skip straight to the decorated key
+    def put(self, key, value, ttl, **kw):
+        return self.client.put((self.namespace, self.revision, key), value, ttl, **kw)
+
+    def add(self, key, value, ttl, **kw):
+        return self.client.add((self.namespace, self.revision, key), value, ttl, **kw)
+
+    def renew(self, key, ttl, **kw):
+        return self.client.renew((self.namespace, self.revision, key), ttl, **kw)
+
+    def delete(self, key):
+        return self.client.delete((self.namespace, self.revision, key))
+
+    def expire(self, key):
+        return self.client.expire((self.namespace, self.revision, key))
 
     def clear(self):
         # Cannot clear a shared client, so, instead, switch revisions
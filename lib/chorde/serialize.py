@@ -170,13 +170,14 @@ class LockWouldBlock(Exception):
 
 
 class ReadWriteLock(object):
-    __slots__ = [ '_read_ready', '_readers' ]
+    __slots__ = [ '_read_ready', '_readers', '_writers_waiting' ]
 
     locktype = staticmethod(Lock)
 
     def __init__(self):
         self._read_ready = Condition(self.locktype())
         self._readers = 0
+        self._writers_waiting = 0
 
     def acquire_read(self, blocking=1):
         if not self._read_ready.acquire(blocking):
@@ -191,7 +192,9 @@ class ReadWriteLock(object):
         self._read_ready.acquire()
         try:
             self._readers -= 1
-            if self._readers == 0:
+            if self._readers == 0 and self._writers_waiting:
+                # Only writers ever wait on the condition, so the
+                # notification can be skipped if there are none
                 self._read_ready.notifyAll()
         finally:
             self._read_ready.release()
@@ -200,7 +203,11 @@ class ReadWriteLock(object):
         if not self._read_ready.acquire(blocking):
             return False
         while self._readers > 0:
-            self._read_ready.wait(blocking or None)
+            self._writers_waiting += 1
+            try:
+                self._read_ready.wait(blocking or None)
+            finally:
+                self._writers_waiting -= 1
             if not blocking and self._readers > 0:
                 self._read_ready.release()
                 return False
@@ -339,17 +346,28 @@ def serialize(*p,**kw):
         # unkeyed lock attribute
         locktype = kw.get('locktype',RLock)
         lockattr = kw.get('lockmember','__serialization_lock')
+        unwatched = deadlock_timeout is None
         def decor(f):  # lint:ok
             if generator:
                 raise NotImplementedError
             else:
                 @wraps(f)
                 def rv(self,*pos,**kw):
-                    if not hasattr(self,lockattr):
+                    # One lookup in the common case, where the lock already exists
+                    lock = getattr(self,lockattr,None)
+                    if lock is None:
                         with _initialization_lock:
-                            if not hasattr(self,lockattr):
-                                setattr(self,lockattr, locktype())
-                    lock = getattr(self,lockattr)
+                            lock = getattr(self,lockattr,None)
+                            if lock is None:
+                                lock = locktype()
+                                setattr(self,lockattr, lock)
+                    if unwatched:
+                        # No watchdog to go through, just grab the lock
+                        getattr(lock, acquire)()
+                        try:
+                            return f(self,*pos,**kw)
+                        finally:
+                            getattr(lock, release)()
                     try:
                         deadlock_watchdog(f,getattr(lock, acquire))
                         return f(self,*pos,**kw)
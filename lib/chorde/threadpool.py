@@ -13,6 +13,21 @@ import weakref
 
 import worker
 
+try:
+    import cython
+except ImportError:
+    # Make cython annotations work without cython
+    _cy_noop = lambda f: f
+    class _cython:
+        locals = staticmethod(lambda **kw: _cy_noop)
+        Py_ssize_t = int
+        int = int
+    globals()['cython'] = _cython
+
+# Default args for apply_async, checked by identity
+_EMPTY_ARGS = ()
+_EMPTY_KWARGS = {}
+
 class TimeoutError(Exception):
     pass
 class TerminateWorker(Exception):
@@ -27,17 +42,11 @@ class WorkerThread(threading.Thread):
         self.__terminate = False
 
     def run(self, TerminateWorker=TerminateWorker):
+        # The target runs its own loop, checking terminated() as it goes,
+        # so normally it's only invoked again if it fails unexpectedly
         while not self.__terminate:
             try:
-                try:
-                    self.target(*self.args,**self.kwargs)
-                finally:
-                    worker_ = worker
-                    if worker_ is None:
-                        # The None check is necessary to avoid errors during interpreter shutdown
-                        self.logger.info("Interpreter shutdown in progress, terminating worker thread")
-                        raise TerminateWorker()
-                    worker._callCleanupHooks()
+                self.target(*self.args,**self.kwargs)
             except TerminateWorker:
                 self.logger.info("Worker terminated")
                 self.terminate(False)
@@ -48,6 +57,9 @@ class WorkerThread(threading.Thread):
         global _nothreads
         threading.Thread.start(self)
 
+    def terminated(self):
+        return self.__terminate
+
     def terminate(self, wait = True):
         self.__terminate = True
         if wait:
@@ -57,31 +69,38 @@ try:
     from clients._async import ExceptionWrapper
 except ImportError:
     class ExceptionWrapper(object):  # lint:ok
-        __slots__ = ('exc',)
+        __slots__ = ('t', 'v', 'tb')
 
         def __init__(self, exc):
-            self.exc = exc
+            self.t, self.v, self.tb = exc
 
         def reraise(self):
-            exc = self.exc
-            del self.exc
-            raise exc[0], exc[1], exc[2]
-
-class WaitIter:
-    def __init__(self, event, timeout = None):
-        self.event = event
-        self.timeout = timeout
-        self._terminate = False
-    def terminate(self):
-        self._terminate = True
-        self.event.set()
-    def __iter__(self):
-        return self
-    def next(self, TerminateWorker=TerminateWorker):
-        if self._terminate:
-            raise TerminateWorker()
-        self.event.wait(self.timeout)
-        raise StopIteration
+            t, v, tb = self.t, self.v, self.tb
+            # Don't keep the traceback (and its frames) alive
+            self.t = self.v = self.tb = None
+            raise t, v, tb
+
+class _ApplySlot(object):
+    """
+    Reusable rendezvous for ThreadPool.apply. Keeping a spare one per thread
+    saves apply from allocating an event and a closure per call.
+    """
+    __slots__ = ('ev', 'rv', 'task', 'args', 'kwargs')
+
+    def __init__(self):
+        self.ev = threading.Event()
+        self.rv = self.task = self.args = self.kwargs = None
+
+    def run(self):
+        try:
+            self.rv = self.task(*self.args, **self.kwargs)
+        except:
+            self.rv = ExceptionWrapper(sys.exc_info())
+        self.ev.set()
+
+    def reset(self):
+        self.rv = self.task = self.args = self.kwargs = None
+        self.ev.clear()
 
 class ThreadPool:
     """
@@ -93,10 +112,16 @@ class ThreadPool:
     This implementation is forcibly a daemon thread pool, which when destroyed
     will cancel all pending tasks, and no task returns any result, and has been
     optimized for that usage pattern.
+
+    The max_slice argument is deprecated and ignored, queues aren't sliced
+    anymore. It's only still accepted for backwards compatibility.
     """
 
     Process = WorkerThread
 
+    # Maximum tasks a worker takes from the work queue at once
+    worker_batch = 32
+
     def __init__(self, workers = None, min_batch = 10, max_batch = 1000, max_slice = None, logger = None,
             name_pattern = None):
         if workers is None:
@@ -107,34 +132,38 @@ class ThreadPool:
         self.logger = logger if logger is not None else logging.getLogger('chorde')
         self.__last_worker_index = 1
         self.__workers = None
+        self.__worker_target = None
         self.__pid = os.getpid()
         self.__spawnlock = threading.Lock()
         self.__swap_lock = threading.Lock()
-        self.__not_empty = threading.Event()
+        self.__cond = threading.Condition(self.__swap_lock)
+        self.__terminate = False
+        self.__not_empty = False # only ever waited on through __cond, so no need for an Event
         self.__empty = threading.Event()
         self.__empty.set()
         self.__cleanup_callbacks = []
 
         self.local = threading.local()
-        self.queues = collections.defaultdict(list)
+        self.__working = {}
+        self.__apply_slots = threading.local()
+        self.queues = collections.defaultdict(collections.deque)
         self.queue_weights = {}
         self.completed_tasks = 0
-        self.__queue_slices = {}
         self.__worklen = 0
+        self.__single_queue = False
+        self.__sched_cache = {}
         self.__workset = set()
-        self.__busyqueues = set()
+        self.__busyquantities = {}
         self.__busyfactors = {}
-        self.__exhausted_iter = WaitIter(self.__not_empty)
-        self.__dequeue = self.__exhausted = self.__exhausted_iter.next
+        self.__dequeue = self.__exhausted = iter(()).next
 
         self.min_batch = min_batch
         self.max_batch = max_batch
-        self.max_slice = max_slice
+        self.max_slice = max_slice # deprecated, queues aren't sliced anymore
 
     def queuelen(self, queue = None):
         return (
             len(self.queues.get(queue,()))
-            - self.__queue_slices.get(queue,0)
             + int(self.__worklen * self.__busyfactors.get(queue,0))
         )
 
@@ -162,12 +191,12 @@ class ThreadPool:
             except:
                 self.logger.error("Error in task cleanup callback", exc_info = True)
 
+    @cython.locals(itotal=cython.Py_ssize_t, qlen=cython.Py_ssize_t,
+        width=cython.Py_ssize_t, rows=cython.Py_ssize_t, col=cython.Py_ssize_t, start=cython.Py_ssize_t,
+        span=cython.Py_ssize_t, pos=cython.Py_ssize_t, end=cython.Py_ssize_t)
     def __swap_queues(self, max=max, min=min, len=len):
         queues = self.queues
         qget = queues.get
-        queue_slices = self.__queue_slices
-        pget = queue_slices.get
-        ppop = queue_slices.pop
         qprio = self.queue_weights.get
         qnames = queues.keys()
         wqueues = []
@@ -180,198 +209,344 @@ class ThreadPool:
             # Must be fair, so we must calibrate the batch ends
             # with all queues more or less at the same time
             # Allow some unfairness (but only some)
-            # Slices are zero-copy (we don't want to copy a lot of stuff)
-            # until maxbatch (we don't want race coditions that result in infinite growth)
-            # maxbatch, if None, means "half the queue" (which auto-amortizes the cost of slicing)
             min_batch = self.min_batch
             max_batch = self.max_batch
-            max_slice = self.max_slice
-            qslots = min(max_batch, max(min_batch, min([
-                (len(qget(q)) or max_batch) / qprio(q,1)
-                for q in qnames
-            ])))
+
+            # Single pass over the queues, picking the live ones along the way
+            live = []
+            qslots = max_batch
             for qname in qnames:
                 q = qget(qname)
-                if not q:
-                    continue
-
-                qpos = pget(qname,0)
                 prio = qprio(qname,1)
-                batch = qslots * prio
+                if q:
+                    slots = len(q) / prio
+                    live.append((qname, q, prio))
+                else:
+                    slots = max_batch / prio
+                if slots < qslots:
+                    qslots = slots
+            qslots = min(max_batch, max(min_batch, qslots))
 
-                # copy-slicing
-                qslice = q[qpos:qpos+batch]
-                qlen = len(qslice)
+            for qname, q, prio in live:
+                qlen = min(qslots * prio, len(q))
+
+                # Take the batch off the queue's head. We're its only consumer
+                # (we hold the swap lock) and producers only append to its tail,
+                # so it can't shrink under us, and there's no need to swap buffers.
                 if qlen:
+                    qpopleft = q.popleft
                     iquantities[qname] = qlen
                     itotal += qlen
-                    wqueues.append(qslice)
+                    wqueues.append([qpopleft() for _ in xrange(qlen)])
                     wprios.append(prio)
-                del qslice
-
-                if qlen < batch or qpos > (max_slice or (len(q)/2)):
-                    del q[:qpos+qlen]
-                    if qpos:
-                        ppop(qname,None)
-                else:
-                    # move slice position
-                    queue_slices[qname] = qpos+qlen
 
         if wqueues:
-            self.__busyqueues.clear()
-            self.__busyqueues.update(qnames)
-
             # Flatten with weights
-            # Do it repeatedly to catch stragglers (those that straggle past the flattening step)
-            iqueue = []
-            iappend = iqueue.append
-            islice = itertools.islice
-            cycle = itertools.cycle
+            # Lay the batches out on a grid with one row per round and prio
+            # columns per queue, and fill it with extended slice assignments.
+            # That's the same weighted round-robin order, but all the copying
+            # happens in C. Each pass fills as many full rounds as all active
+            # queues can supply, and then one last round in which at least one
+            # of them runs out, so there are at most as many passes as queues.
             izip = itertools.izip
             repeat = itertools.repeat
-            partial = functools.partial
-
-            queues = []
-            for q,qprio in izip(wqueues, wprios):
-                queues.append(partial(repeat, iter(q).next, qprio))
-
-            ioffs = 0
-            while queues:
-                try:
-                    for ioffs,q in islice(cycle(enumerate(queues)), ioffs, None):
-                        for q in q():
-                            iappend(q())
-                except StopIteration:
-                    del queues[ioffs]
+            iqueue = []
+            iextend = iqueue.extend
+            active = [[q, prio, 0] for q,prio in izip(wqueues, wprios)]
+            while active:
+                width = sum([prio for q,prio,pos in active])
+                rows = min([(len(q) - pos) // prio for q,prio,pos in active])
+                if rows:
+                    col = len(iqueue)
+                    span = rows * width
+                    iextend(repeat(None, span))
+                    if not col:
+                        # First pass, with all queues untouched. That's usually the whole
+                        # flatten in the steady state, and its layout depends only on
+                        # priorities and rows, so it's cached.
+                        for qindex, dst, src in self.__schedule(wprios, rows):
+                            iqueue[dst] = wqueues[qindex][src]
+                        for entry in active:
+                            entry[2] = rows * entry[1]
+                    else:
+                        for entry in active:
+                            q, prio, pos = entry
+                            end = pos + rows * prio
+                            for k in xrange(prio):
+                                start = col + k
+                                iqueue[start:start + span:width] = q[pos + k:end:prio]
+                            col += prio
+                            entry[2] = end
+                still_active = []
+                for entry in active:
+                    q, prio, pos = entry
+                    end = pos + prio
+                    iextend(q[pos:end])
+                    if end < len(q):
+                        entry[2] = end
+                        still_active.append(entry)
+                active = still_active
 
             self.__worklen = len(iqueue)
+            self.__single_queue = len(wqueues) == 1
             self.__dequeue = iter(iqueue).next
-            if itotal:
+
+            # Saturated queues yield the same quantities swap after swap,
+            # so the factors only need rebuilding when those change.
+            # queuelen reads them without locking, so they're replaced, never mutated.
+            if iquantities != self.__busyquantities:
                 ftotal = float(itotal)
+                self.__busyquantities = iquantities
                 self.__busyfactors = dict([(qname, quant/ftotal) for qname,quant in iquantities.iteritems()])
-            else:
-                self.__busyfactors = {}
-        elif self.__dequeue is not self.__exhausted:
-            self.__not_empty.clear()
+        elif self.__dequeue is not self.__exhausted or self.__not_empty:
+            # This is a transition from working to empty, which means
+            # until now, pushing threads didn't set the weakeup call event,
+            # or someone sneaked in after we last cleared it.
+            self.__not_empty = False
             self.__worklen = 0
-            self.__busyfactors = {}
+            if self.__busyquantities:
+                self.__busyquantities = {}
+                self.__busyfactors = {}
             self.__dequeue = self.__exhausted
 
             # Try again
-            # This is a transition from working to empty, which means
-            # until now, pushing threads didn't set the weakeup call event.
-            # So, before actually sleeping, try again
-            self.__swap_queues()
-        elif self.__not_empty.isSet():
-            # Try again
-            # Someone may have sneaked in while we were in the above case
-            # and may still neak in after we clear the not_empty event
-            self.__not_empty.clear()
-            self.__worklen = 0
-            self.__busyfactors = {}
-            self.__dequeue = self.__exhausted
+            # Pushes that race with the clear may not signal us,
+            # so rescan the queues before actually sleeping
             self.__swap_queues()
         else:
             # Still empty, can safely give up until signaled
             # Wake up threads trying to join
             self.__empty.set()
 
-    def _dequeue(self, TerminateWorker=TerminateWorker):
-        tid = thread.get_ident()
+    def __schedule(self, prios, rows):
+        """
+        Returns the (queue index, destination slice, source slice) triplets that lay
+        out rows full weighted round-robin rounds of queues with the given priorities.
+        """
+        key = (tuple(prios), rows)
+        sched_cache = self.__sched_cache
+        template = sched_cache.get(key)
+        if template is None:
+            width = sum(prios)
+            span = rows * width
+            template = []
+            col = 0
+            for qindex, prio in enumerate(prios):
+                end = rows * prio
+                for k in xrange(prio):
+                    start = col + k
+                    template.append((qindex, slice(start, start + span, width), slice(k, end, prio)))
+                col += prio
+            if len(sched_cache) >= 64:
+                sched_cache.clear()
+            sched_cache[key] = template
+        return template
+
+    @cython.locals(termcount=cython.int)
+    def _dequeue(self, TerminateWorker=TerminateWorker, get_ident=thread.get_ident, any=any):
+        tid = get_ident()
         workset = self.__workset
+        workset_add = workset.add
+        workset_discard = workset.discard
+        exhausted = self.__exhausted
+        queues = self.queues
+        queues_values = queues.values
         termcount = 0
         while True:
-            if (self.__dequeue is self.__exhausted and not self.__not_empty.isSet()
-                    and (not self.queues or not any(self.queues.values()))):
+            if (self.__dequeue is exhausted and not self.__not_empty
+                    and (not queues or not any(queues_values()))):
                 # Sounds like there's nothing to do
                 # Yeah, gonna wait
-                workset.discard(tid)
-                if not workset and (not self.queues or not any(self.queues.values())):
+                workset_discard(tid)
+                if not workset and (not queues or not any(queues_values())):
                     self.__empty.set()
             else:
-                workset.add(tid)
+                workset_add(tid)
             try:
                 rv = self.__dequeue()
                 self.__worklen -= 1 # not atomic, but we don't care
                 return rv
-            except (TerminateWorker, StopIteration) as e:
+            except StopIteration:
                 # Exhausted whole workqueue?
                 with self.__swap_lock:
+                    # Sleep until _enqueue signals us. It always sets not_empty
+                    # before notifying, so checking it under the lock can't miss a wakeup
+                    while (self.__dequeue is exhausted and not self.__not_empty
+                            and not self.__terminate):
+                        workset_discard(tid)
+                        if not workset:
+                            # Last one to go idle, wake up threads trying to join
+                            self.__empty.set()
+                        self.__cond.wait()
                     try:
-                        if self.__dequeue is self.__exhausted:
+                        if self.__dequeue is exhausted:
                             # Pointless to wait, just swap again
-                            if termcount > 0:
+                            # Unless stop() woke us up, we'd only go back to sleep
+                            if termcount > 0 or threading.current_thread().terminated():
                                 raise TerminateWorker()
-                            else:
+                            elif self.__terminate:
                                 # First time we get the terminate signal, we try to swap queues
                                 # to flush any queued tasks. If we get 2 consecutive signals,
                                 # that means we're done with the queue.
-                                if isinstance(e, TerminateWorker):
-                                    termcount += 1
-                                raise StopIteration
+                                termcount += 1
+                            raise StopIteration
                         else:
                             # Try it
-                            workset.add(tid)
+                            workset_add(tid)
                             rv = self.__dequeue()
                             self.__worklen -= 1 # not atomic, but we don't care
+                            if self.__worklen > 0:
+                                # Pass the baton, there's enough work for another worker
+                                self.__cond.notify()
                             return rv
                     except StopIteration:
                         # Yep, exhausted queue, build up new workqueue
                         self.__swap_queues()
+                        if self.__dequeue is not exhausted:
+                            self.__cond.notify()
                     except TerminateWorker:
                         # Wake up others so they check, if they're sleeping
-                        workset.discard(tid)
-                        self.__not_empty.set()
+                        workset_discard(tid)
+                        self.__not_empty = True
+                        self.__cond.notify_all()
                         raise
 
-    def _enqueue(self, queue, task):
+    @cython.locals(n=cython.Py_ssize_t)
+    def _multi_dequeue(self, n, islice=itertools.islice):
+        """
+        Like _dequeue, but returns a list of up to n tasks. Extra tasks are only
+        handed out when there's enough queued work for all workers to get a whole
+        batch, so a slow task can't hold back others an idle worker could be running.
+        And only when the work queue holds a single queue's tasks, since a batch
+        spanning several scheduling slots would undo the weighted round-robin.
+        """
+        rv = [self._dequeue()]
+        if not self.__single_queue:
+            return rv
+        n = min(n - 1, self.__worklen // self.workers)
+        if n > 0:
+            # No need for the swap lock, if the current work queue runs out
+            # we'll just get a shorter batch
+            more = list(islice(self.__dequeue.__self__, n))
+            self.__worklen -= len(more) # not atomic, but we don't care
+            rv.extend(more)
+        return rv
+
+    def _enqueue(self, queue, task, getpid=os.getpid):
+        # Clear it before the task is visible, or a worker could drain it
+        # and set it again before we get here, leaving it wrongly cleared
+        empty = self.__empty
+        if empty.isSet():
+            empty.clear()
+
         self.queues[queue].append(task)
 
-        # Wake up waiting threads
+        # Wake up a waiting thread
         # Note that it's not necessary to invoke this all the time. If the
         # flags are the right way at any point within this function being
         # run, then it already means the respective waiting threads have
         # woken up (or are in the process of waking up) in time to pick up the
         # just-queued value, so avoid the actual operation
         # (which is much more expensive than checking)
-        not_empty = self.__not_empty
-        if not not_empty.isSet():
-            not_empty.set()
-        empty = self.__empty
-        if empty.isSet():
-            empty.clear()
+        # The woken thread will wake up others if there's enough work for them.
+        if not self.__not_empty:
+            self.__not_empty = True
+            cond = self.__cond
+            with cond:
+                cond.notify()
+
+        # Inlined assert_started, saves a couple of calls per submission
+        if self.__workers is None or self.__pid != getpid():
+            self.populate_workers()
 
-        self.assert_started()
+    def _enqueue_many(self, queue, tasks):
+        # Leaving the last one to _enqueue takes care of the wakeup, once,
+        # and after all the others are already in the queue
+        if tasks:
+            last = tasks.pop()
+            self.queues[queue].extend(tasks)
+            self._enqueue(queue, last)
 
     @staticmethod
-    def worker(self, TerminateWorker=TerminateWorker):
-        self = self()
-        if self is None:
-            raise TerminateWorker()
-
-        task = self._dequeue()
-        local = self.local
-        if task is not None:
-            try:
-                local.working = True
-                task()
-
-                # really couldn't care less about thread safety here ;)
-                self.completed_tasks += 1
-                if self.completed_tasks > (1<<30):
-                    self.completed_tasks = 0
-            finally:
-                try:
-                    self._call_cleanup_callbacks()
-                except:
-                    self.logger.error("Error in task cleanup hook", exc_info = True)
-                try:
-                    del local.working
-                except:
-                    pass
-
-    def in_worker(self):
-        return getattr(self.local, 'working', False)
+    def worker(pool_ref, TerminateWorker=TerminateWorker):
+        terminated = threading.current_thread().terminated
+        pool = pool_ref()
+        while pool is not None:
+            pool._work()
+            if terminated():
+                return
+
+            # Only hold on to the pool while working on a batch
+            pool = pool_ref()
+        raise TerminateWorker()
+
+    def _work(self, tuple=tuple, type=type, get_ident=thread.get_ident, TerminateWorker=TerminateWorker):
+        tasks = self._multi_dequeue(self.worker_batch)
+
+        # A plain dict keyed by thread id is a lot cheaper than threading.local,
+        # and the flag only needs setting once per batch
+        working = self.__working
+        tid = get_ident()
+        working[tid] = True
+        cleanup_callbacks = self.__cleanup_callbacks
+        pending = len(tasks)
+        try:
+            for task in tasks:
+                pending -= 1
+                if task is not None:
+                    try:
+                        if type(task) is tuple:
+                            fn, args, kwargs = task
+                            if kwargs:
+                                fn(*args, **kwargs)
+                            else:
+                                # Skip keyword handling, most tasks only take positional args
+                                fn(*args)
+                        else:
+                            task()
+
+                        # really couldn't care less about thread safety here ;)
+                        self.completed_tasks += 1
+                        if self.completed_tasks > (1<<30):
+                            self.completed_tasks = 0
+                    except Exception:
+                        # Don't let it abort the rest of the batch
+                        self.logger.error("Exception ocurred in worker thread:", exc_info = True)
+
+                    # No finally needed, anything that gets past the except above
+                    # is going to kill the worker anyway. Callbacks guard their own errors.
+                    if cleanup_callbacks:
+                        self._call_cleanup_callbacks()
+
+                # Thread cleanup hooks still run after every task, batch or not
+                worker_ = worker
+                if worker_ is None:
+                    # The None check is necessary to avoid errors during interpreter shutdown
+                    self.logger.info("Interpreter shutdown in progress, terminating worker thread")
+                    raise TerminateWorker()
+                worker_._callCleanupHooks()
+        finally:
+            working.pop(tid, None)
+            if pending:
+                # Something killed the worker mid-batch, don't lose the rest
+                self._requeue(tasks[len(tasks) - pending:])
+
+    def _requeue(self, tasks):
+        """
+        Puts tasks a dying worker took but didn't get to run back at the head of
+        the default queue, so the remaining workers pick them up next.
+        """
+        self.logger.warning("Worker thread terminated mid-batch, requeueing %d tasks", len(tasks))
+        with self.__swap_lock:
+            # It's not going to be working on anything anymore, don't let join wait for it
+            self.__workset.discard(thread.get_ident())
+            self.__empty.clear()
+            self.queues[None].extendleft(reversed(tasks))
+            self.__not_empty = True
+            self.__cond.notify()
+
+    def in_worker(self, get_ident=thread.get_ident):
+        return self.__working.get(get_ident(), False)
 
     def is_started(self):
         return not(self.__workers is None or self.__pid != os.getpid())
@@ -391,11 +566,15 @@ class ThreadPool:
                 self.__workers = None
 
             # Wake up threads so they die awake
-            self.__not_empty.set()
+            self.__not_empty = True
+            with self.__cond:
+                self.__cond.notify_all()
 
     def close(self):
         # Signal idle threads to commit suicide
-        self.__exhausted_iter.terminate()
+        self.__terminate = True
+        with self.__cond:
+            self.__cond.notify_all()
 
     def terminate(self):
         self.stop()
@@ -417,7 +596,7 @@ class ThreadPool:
         while timeout is None or now < timeout:
             if timeout is not None:
                 wait_timeout = timeout - now
-            elif self.__exhausted_iter._terminate:
+            elif self.__terminate:
                 # If the pool is shut down in a way that aborts all queued tasks, we can't
                 # merely wait for the empty event to be set, we have to also monitor suiciding threads
                 if not self.is_started():
@@ -436,7 +615,12 @@ class ThreadPool:
                         # False alarm, clear it so we don't spin
                         self.__empty.clear()
             else:
-                # Timeout
+                # Timeout, or the event got cleared again by a push before we woke up,
+                # in which case there's still time left to wait
+                if timeout is not None:
+                    now = time.time()
+                    if now < timeout:
+                        continue
                 if timeout is not None or not self.__workset:
                     return (self.__dequeue is self.__exhausted and not self.__workset
                         and (not self.queues or not any(self.queues.values())))
@@ -447,12 +631,17 @@ class ThreadPool:
 
     def populate_workers(self):
         with self.__spawnlock:
+            # All workers share the one target, and its weak reference
+            target = self.__worker_target
+            if target is None:
+                target = self.__worker_target = functools.partial(self.worker, weakref.ref(self))
+
             if not self.is_started():
                 name_pattern = self.name_pattern
                 index_base = self.__last_worker_index
                 self.__last_worker_index += self.workers
                 self.__workers = [ self.Process(
-                        functools.partial(self.worker, weakref.ref(self)),
+                        target,
                         name = name_pattern % (i+index_base,) if name_pattern is not None else None
                     ) for i in xrange(self.workers) ]
                 for w in self.__workers:
@@ -468,10 +657,11 @@ class ThreadPool:
                 index_base = self.__last_worker_index
                 self.__last_worker_index += new_workers
                 nworkers = [ self.Process(
-                        functools.partial(self.worker, weakref.ref(self)),
+                        target,
                         name = name_pattern % (i+index_base,) if name_pattern is not None else None
                     ) for i in xrange(new_workers) ]
                 for w in nworkers:
+                    w.logger = self.logger
                     w.daemon = True
                     w.start()
                 self.__workers.extend(nworkers)
@@ -481,33 +671,198 @@ class ThreadPool:
                 for w in nworkers:
                     w.terminate(False)
 
-    def apply_async(self, task, args = (), kwargs = {}, queue = None):
-        if args or kwargs:
-            task = functools.partial(task, *args, **kwargs)
+    def apply_async(self, task, args = _EMPTY_ARGS, kwargs = _EMPTY_KWARGS, queue = None):
+        if args is not _EMPTY_ARGS or kwargs is not _EMPTY_KWARGS:
+            # Cheaper than a partial, worker knows how to call it
+            task = (task, args, kwargs)
+        self._enqueue(queue, task)
+
+    def submit(self, task, queue = None):
+        """
+        Like apply_async for argument-less tasks, skipping the argument handling
+        """
         self._enqueue(queue, task)
 
+    def apply_async_many(self, task, args_iter, queue = None):
+        """
+        Like calling apply_async(task, args) for each args in args_iter,
+        but it queues them all at once
+        """
+        self._enqueue_many(queue, [(task, args, _EMPTY_KWARGS) for args in args_iter])
+
     def apply(self, task, args = (), kwargs = {}, queue = None, timeout = None):
-        rv = []
-        ev = threading.Event()
-        def stask():
-            try:
-                rv.append(task(*args, **kwargs))
-            except:
-                rv.append(ExceptionWrapper(sys.exc_info()))
-            ev.set()
-        self._enqueue(queue, stask)
-        if ev.wait(timeout):
-            rv = rv[0]
+        # apply blocks until done, so a thread never needs more than one slot at a time
+        apply_slots = self.__apply_slots
+        slot = getattr(apply_slots, 'spare', None)
+        if slot is None:
+            slot = _ApplySlot()
+        else:
+            apply_slots.spare = None
+        slot.task = task
+        slot.args = args
+        slot.kwargs = kwargs
+        # Bind run only here, a bound method stored in the slot would make it a cycle
+        self._enqueue(queue, slot.run)
+        if slot.ev.wait(timeout):
+            rv = slot.rv
+            slot.reset()
+            apply_slots.spare = slot
             if isinstance(rv, ExceptionWrapper):
                 rv.reraise()
             else:
                 return rv
         else:
+            # The task may still run later, so the slot can't be reused
             raise TimeoutError
 
     def subqueue(self, queue, *p, **kw):
         return SubqueueWrapperThreadPool(self, queue, *p, **kw)
 
+class ShardedThreadPool:
+    """
+    A thread pool composed of several independent ThreadPool shards, each
+    with its own queues, swap lock and share of the workers.
+
+    Submitting threads are spread among shards in round-robin fashion, so
+    heavy concurrent submission doesn't contend on a single pool. Named queue
+    priorities are honored within each shard, but ordering across shards is
+    not, so only use it for tasks that don't depend on submission order.
+
+    Worker names, if a name_pattern is given, get the shard index appended.
+    """
+
+    Shard = ThreadPool
+
+    def __init__(self, workers = None, shards = None, name_pattern = None, **kw):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if shards is None:
+            shards = min(workers, 8)
+        shards = max(1, min(shards, workers))
+
+        self.workers = workers
+        self.local = threading.local()
+        self._shard_local = threading.local() # our own, local is for callers
+        self._start_counter = itertools.count()
+        self._shards = [
+            self.Shard(workers // shards + (i < workers % shards),
+                name_pattern = name_pattern + '/shard%d' % (i,) if name_pattern is not None else None,
+                **kw)
+            for i in xrange(shards)
+        ]
+
+    def _shard(self):
+        local = self._shard_local
+        try:
+            next_shard = local.next_shard
+        except AttributeError:
+            # Stagger each thread's starting point, so threads that only submit
+            # a few tasks don't all pile up on the first shard
+            shards = self._shards
+            start = next(self._start_counter) % len(shards)
+            next_shard = local.next_shard = itertools.cycle(shards[start:] + shards[:start]).next
+        shard = next_shard()
+        if not shard.is_started():
+            # Lazily start all shards at once
+            self.assert_started()
+        return shard
+
+    def queuelen(self, queue = None):
+        return sum([shard.queuelen(queue) for shard in self._shards])
+
+    # alias for multiprocessing.pool compatibility
+    qsize = queuelen
+
+    # alias for multiprocessing.pool compatibility
+    @property
+    def _taskqueue(self):
+        return self
+
+    @property
+    def completed_tasks(self):
+        return sum([shard.completed_tasks for shard in self._shards])
+
+    def queueprio(self, queue = None):
+        return self._shards[0].queueprio(queue)
+
+    def set_queueprio(self, prio, queue = None):
+        for shard in self._shards:
+            shard.set_queueprio(prio, queue)
+
+    def register_cleanup_callback(self, callback):
+        for shard in self._shards:
+            shard.register_cleanup_callback(callback)
+
+    def in_worker(self):
+        return any([shard.in_worker() for shard in self._shards])
+
+    def is_started(self):
+        return all([shard.is_started() for shard in self._shards])
+
+    def check_started(self):
+        return all([shard.check_started() for shard in self._shards])
+
+    def stop(self, wait = False):
+        for shard in self._shards:
+            shard.stop(wait)
+
+    def close(self):
+        for shard in self._shards:
+            shard.close()
+
+    def terminate(self):
+        for shard in self._shards:
+            shard.terminate()
+
+    def start(self):
+        for shard in self._shards:
+            shard.start()
+
+    def assert_started(self):
+        for shard in self._shards:
+            shard.assert_started()
+
+    def join(self, timeout = None):
+        if timeout is not None:
+            timeout += time.time()
+        shards = self._shards
+        while True:
+            for shard in shards:
+                if timeout is not None:
+                    # The check below decides, and keeps going until the deadline
+                    shard.join(max(0, timeout - time.time()))
+                elif not shard.join():
+                    return False
+
+            # Tasks running on later shards may have queued more work on shards
+            # already joined, so only a whole pass that finds every shard idle,
+            # with no task completing meanwhile, means we're done
+            completed = [shard.completed_tasks for shard in shards]
+            if (all([shard.join(0) for shard in shards])
+                    and completed == [shard.completed_tasks for shard in shards]):
+                return True
+            if timeout is not None and time.time() >= timeout:
+                return False
+
+    def populate_workers(self):
+        for shard in self._shards:
+            shard.populate_workers()
+
+    def apply_async(self, task, args = _EMPTY_ARGS, kwargs = _EMPTY_KWARGS, queue = None):
+        return self._shard().apply_async(task, args, kwargs, queue)
+
+    def submit(self, task, queue = None):
+        return self._shard().submit(task, queue)
+
+    def apply_async_many(self, task, args_iter, queue = None):
+        return self._shard().apply_async_many(task, args_iter, queue)
+
+    def apply(self, task, args = (), kwargs = {}, queue = None, timeout = None):
+        return self._shard().apply(task, args, kwargs, queue, timeout)
+
+    def subqueue(self, queue, *p, **kw):
+        return SubqueueWrapperThreadPool(self, queue, *p, **kw)
+
 class SubqueueWrapperThreadPool:
     """
     Re-implementation of multiprocessing.pool.ThreadPool optimized for threads
@@ -580,9 +935,15 @@ class SubqueueWrapperThreadPool:
     def populate_workers(self):
         return self.pool.populate_workers()
 
-    def apply_async(self, task, args = (), kwargs = {}):
+    def apply_async(self, task, args = _EMPTY_ARGS, kwargs = _EMPTY_KWARGS):
         return self.pool.apply_async(task, args, kwargs, queue = self.queue)
 
+    def submit(self, task):
+        return self.pool.submit(task, self.queue)
+
+    def apply_async_many(self, task, args_iter):
+        return self.pool.apply_async_many(task, args_iter, self.queue)
+
     def apply(self, task, args = (), kwargs = {}, timeout = None):
         return self.pool.apply(task, args, kwargs, self.queue, timeout)
 
@@ -86,6 +86,7 @@ if not no_pyrex:
                 cython_include_dirs = [libdir, os.path.join(libdir, "chorde", "clients")],
                 extra_compile_args = [ "-O3" ] ),
             Extension("chorde.decorators", ["lib/chorde/decorators.py"]),
+            Extension("chorde.threadpool", ["lib/chorde/threadpool.py"]),
             Extension("chorde.clients.base", ["lib/chorde/clients/base.py"]),
             Extension("chorde.clients.inproc", ["lib/chorde/clients/inproc.py"]),
             Extension("chorde.clients.tiered", ["lib/chorde/clients/tiered.py"]),
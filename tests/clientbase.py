@@ -5,6 +5,10 @@ from chorde.clients.base import SyncAdapter, ReadWriteSyncAdapter, NamespaceWrap
 
 import time
 
+# Checking for misses with a default is a lot cheaper than with exceptions,
+# testGet and friends make sure misses also raise
+_MISS = object()
+
 class CacheClientTestMixIn:
     capacity_means_entries = True
     is_lru = True
@@ -178,8 +182,8 @@ class CacheClientTestMixIn:
         self.assertEqual(client.get(5), 12)
 
         client.clear()
-        self.assertRaises(CacheMissError, client.get, 4)
-        self.assertRaises(CacheMissError, client.get, 5)
+        self.assertIs(client.get(4, _MISS), _MISS)
+        self.assertIs(client.get(5, _MISS), _MISS)
 
     def testPurge(self):
         client = self.client
@@ -203,7 +207,7 @@ class CacheClientTestMixIn:
         self.assertEqual(client.get(5), 12)
 
         client.delete(4)
-        self.assertRaises(CacheMissError, client.get, 4)
+        self.assertIs(client.get(4, _MISS), _MISS)
         self.assertEqual(client.get(5), 12)
 
     def testExpire(self):
@@ -222,17 +226,18 @@ class CacheClientTestMixIn:
 
         client = self.client
         cap = client.capacity
+        put = client.put
+        assertEqual = self.assertEqual
 
-        self.assertEqual(client.usage, 0)
+        assertEqual(client.usage, 0)
 
         for i in xrange(cap):
-            client.put(i,i,86400)
-            self.assertEqual(client.usage, i+1)
+            put(i,i,86400)
+            assertEqual(client.usage, i+1)
 
-        for i in xrange(cap):
-            i += cap
-            client.put(i,i,86400)
-            self.assertEqual(client.usage, cap)
+        for i in xrange(cap, 2*cap):
+            put(i,i,86400)
+            assertEqual(client.usage, cap)
 
     def testLRU(self):
         if not self.is_lru:
@@ -242,10 +247,12 @@ class CacheClientTestMixIn:
 
         client = self.client
         cap = client.capacity
+        put = client.put
+        assertEqual = self.assertEqual
 
         for i in xrange(cap):
-            client.put(i,i,86400)
-            self.assertEqual(client.usage, i+1)
+            put(i,i,86400)
+            assertEqual(client.usage, i+1)
 
         self.assertTrue(client.contains(0))
         client.put(cap,cap,86400)
@@ -281,15 +288,15 @@ class NamespaceWrapperTestMixIn(CacheClientTestMixIn):
         self.rclient.put(4, 7, 10)
 
         self.assertEqual(self.client.get(1), 2)
-        self.assertRaises(CacheMissError, self.bclient.get, 1)
-        self.assertRaises(CacheMissError, self.rclient.get, 1)
+        self.assertIs(self.bclient.get(1, _MISS), _MISS)
+        self.assertIs(self.rclient.get(1, _MISS), _MISS)
 
-        self.assertRaises(CacheMissError, self.client.get, 2)
+        self.assertIs(self.client.get(2, _MISS), _MISS)
         self.assertEqual(self.bclient.get(2), 3)
-        self.assertRaises(CacheMissError, self.rclient.get, 2)
+        self.assertIs(self.rclient.get(2, _MISS), _MISS)
 
-        self.assertRaises(CacheMissError, self.client.get, 3)
-        self.assertRaises(CacheMissError, self.bclient.get, 3)
+        self.assertIs(self.client.get(3, _MISS), _MISS)
+        self.assertIs(self.bclient.get(3, _MISS), _MISS)
         self.assertEqual(self.rclient.get(3), 4)
 
         self.assertEqual(self.client.get(4), 5)
@@ -305,15 +312,15 @@ class NamespaceWrapperTestMixIn(CacheClientTestMixIn):
         self.rclient.put(4, 7, 10)
 
         self.assertEqual(self.client.get(1), 2)
-        self.assertRaises(CacheMissError, self.bclient.get, 1)
-        self.assertRaises(CacheMissError, self.rclient.get, 1)
+        self.assertIs(self.bclient.get(1, _MISS), _MISS)
+        self.assertIs(self.rclient.get(1, _MISS), _MISS)
 
-        self.assertRaises(CacheMissError, self.client.get, 2)
+        self.assertIs(self.client.get(2, _MISS), _MISS)
         self.assertEqual(self.bclient.get(2), 3)
-        self.assertRaises(CacheMissError, self.rclient.get, 2)
+        self.assertIs(self.rclient.get(2, _MISS), _MISS)
 
-        self.assertRaises(CacheMissError, self.client.get, 3)
-        self.assertRaises(CacheMissError, self.bclient.get, 3)
+        self.assertIs(self.client.get(3, _MISS), _MISS)
+        self.assertIs(self.bclient.get(3, _MISS), _MISS)
         self.assertEqual(self.rclient.get(3), 4)
 
         self.assertEqual(self.client.get(4), 5)
@@ -321,11 +328,11 @@ class NamespaceWrapperTestMixIn(CacheClientTestMixIn):
         self.assertEqual(self.rclient.get(4), 7)
 
         self.client.clear()
-        self.assertRaises(CacheMissError, self.client.get, 4)
+        self.assertIs(self.client.get(4, _MISS), _MISS)
         self.assertEqual(self.bclient.get(4), 6)
         self.assertEqual(self.rclient.get(4), 7)
 
         self.bclient.clear()
-        self.assertRaises(CacheMissError, self.client.get, 4)
-        self.assertRaises(CacheMissError, self.bclient.get, 4)
+        self.assertIs(self.client.get(4, _MISS), _MISS)
+        self.assertIs(self.bclient.get(4, _MISS), _MISS)
         self.assertEqual(self.rclient.get(4), 7)
@@ -1,15 +1,25 @@
 # -*- coding: utf-8 -*-
 import collections
+import imp
+import itertools
+import os
+import sys
 import thread
-from threading import Event, Thread
+from threading import Event, Thread, current_thread
 import multiprocessing.pool
 import time
 import unittest
 
-from chorde.threadpool import ThreadPool
+import chorde.worker
+from chorde.threadpool import ThreadPool, ShardedThreadPool, SubqueueWrapperThreadPool
 
 from .base import TestCase
 
+_MISSING = object()
+
+# Tests for chorde-specific behavior skip multiprocessing's pool
+_CHORDE_POOLS = (ThreadPool, ShardedThreadPool, SubqueueWrapperThreadPool)
+
 class ThreadpoolTest(TestCase):
     def setUp(self):
         self.pool = ThreadPool()
@@ -37,6 +47,28 @@ class ThreadpoolTest(TestCase):
         time.sleep(0.01)
         self.assertTrue(called)
 
+    def testThreadCleanupHooks(self):
+        if not isinstance(self.pool, _CHORDE_POOLS):
+            self.skipTest("Not implemented")
+        # Hooks must run after every task, even when workers take them in batches
+        hook_counts = collections.defaultdict(int)
+        seen = collections.defaultdict(list)
+        def hook():
+            hook_counts[thread.get_ident()] += 1
+        def task():
+            tid = thread.get_ident()
+            seen[tid].append(hook_counts[tid])
+        chorde.worker.registerThreadCleanupFunction(hook)
+        try:
+            for i in xrange(1000):
+                self.pool.apply_async(task)
+            self.join_continue(self.pool, 60)
+        finally:
+            chorde.worker._cleanupHooks.remove(hook)
+        self.assertEqual(sum(map(len, seen.values())), 1000)
+        for counts in seen.values():
+            self.assertEqual(len(set(counts)), len(counts))
+
     def testCleanupCallbackErrors(self):
         if not hasattr(self.pool, 'register_cleanup_callback'):
             self.skipTest("Not implemented")
@@ -86,94 +118,180 @@ class ThreadpoolTest(TestCase):
         self.assertEqual(nworkers, nworkers2)
         self.assertFalse(workers2[0] is workers[0])
 
+    def testStopEndsIdleWorkers(self):
+        if not hasattr(self.pool, '_ThreadPool__workers'):
+            self.skipTest("Not implemented")
+        self.pool.apply(time.time, timeout=5)
+        workers = list(getattr(self.pool, '_ThreadPool__workers'))
+        self.pool.stop()
+        for w in workers:
+            w.join(5)
+            self.assertFalse(w.is_alive())
+
     def testAsyncLatency(self):
         # Warm up the pool
         self.pool.apply(lambda:None)
 
+        now = time.time
+        apply_async = self.pool.apply_async
+        ev = Event()
+        worst = 0
         for i in xrange(100):
-            t0 = time.time()
-            ev = Event()
-            self.pool.apply_async(ev.set)
+            t0 = now()
+            ev.clear()
+            apply_async(ev.set)
             ev.wait()
-            t1 = time.time()
-            self.assertLess(t1-t0, 0.05)
+            worst = max(worst, now()-t0)
+        self.assertLess(worst, 0.05)
 
     def testAsyncBlocking(self):
         # Warm up the pool
         self.pool.apply(lambda:None)
 
+        now = time.time
+        apply_async = self.pool.apply_async
+        ev = Event()
+        worst = 0
         for i in xrange(100):
-            t0 = time.time()
-            ev = Event()
-            self.pool.apply_async(ev.set)
-            t1 = time.time()
+            t0 = now()
+            ev.clear()
+            apply_async(ev.set)
+            worst = max(worst, now()-t0)
             self.assertTrue(ev.wait(1))
-            self.assertLess(t1-t0, 0.05)
+        self.assertLess(worst, 0.05)
+
+    def testSubmit(self):
+        if not hasattr(self.pool, 'submit'):
+            self.skipTest("Not implemented")
+        ev = Event()
+        self.pool.submit(ev.set)
+        self.assertTrue(ev.wait(1))
 
     def testSyncLatency(self):
         # Warm up the pool
         self.pool.apply(lambda:None)
 
+        now = time.time
+        apply = self.pool.apply
+        worst = 0
         for i in xrange(100):
-            t0 = time.time()
-            t1 = self.pool.apply(time.time)
-            self.assertLess(t1-t0, 0.05)
+            t0 = now()
+            worst = max(worst, apply(now)-t0)
+        self.assertLess(worst, 0.05)
 
     def testExceptions(self):
         def raiseme():
             raise RuntimeError
         self.assertRaises(RuntimeError, self.pool.apply, raiseme)
 
-    def testConcurrency(self):
+    def check_concurrency(self, submit):
+        # Runs submit(accounting, N) from M threads at once, and checks
+        # accounting got called N times for each of them
         N = 10000
         M = 50
-        counts = collections.defaultdict(int)
+        # count.next is atomic, so no need for per-thread counters
+        count = itertools.count().next
         def accounting(i):
-            counts[thread.get_ident()] += 1
-        def killit(i):
-            for j in xrange(N):
-                self.pool.apply_async(accounting, (i,))
-        threads = [ Thread(target=killit, args=(i,)) for i in xrange(M) ]
+            count()
+        threads = [ Thread(target=submit, args=(accounting, N)) for i in xrange(M) ]
         for t in threads:
             t.start()
         for t in threads:
             t.join()
         self.join_continue(self.pool, 60)
-        total_counts = self.pool.apply(sum, (counts.itervalues(),))
+        total_counts = self.pool.apply(count)
         self.assertEqual(total_counts, N*M)
 
+    def testConcurrency(self):
+        def killit(accounting, N):
+            apply_async = self.pool.apply_async
+            args = (0,)
+            for j in xrange(N):
+                apply_async(accounting, args)
+        self.check_concurrency(killit)
+
+    def testConcurrencyMany(self):
+        if not hasattr(self.pool, 'apply_async_many'):
+            self.skipTest("Not implemented")
+        def killit(accounting, N):
+            self.pool.apply_async_many(accounting, [(0,)] * N)
+        self.check_concurrency(killit)
+
+    def testChainedJoin(self):
+        if not isinstance(self.pool, _CHORDE_POOLS):
+            self.skipTest("Not implemented")
+        # join must also wait for work queued by running tasks, wherever it lands
+        pool = self.pool
+        done = []
+        def chain(n):
+            if n:
+                pool.apply_async(chain, (n - 1,))
+            else:
+                done.append(None)
+        for i in xrange(50):
+            del done[:]
+            pool.apply_async(chain, (6,))
+            self.assertTrue(pool.join(5))
+            self.assertEqual(done, [None])
+
+    def testBatchRequeue(self):
+        # Tasks batched behind one that kills its worker must still run
+        count = itertools.count().next
+        started = []
+        release = Event()
+        def blocker():
+            started.append(None)
+            release.wait()
+        def killer():
+            raise SystemExit
+        pool = ThreadPool(2)
+        try:
+            pool.apply_async(blocker)
+            pool.apply_async(blocker)
+            while len(started) < 2:
+                time.sleep(0.001)
+            # Both workers are busy, so these all get swapped in together
+            pool.apply_async(killer)
+            for i in xrange(100):
+                pool.apply_async(count)
+            release.set()
+            self.assertTrue(pool.join(60))
+            self.assertEqual(count(), 100)
+        finally:
+            release.set()
+            self.join_close(pool, 60)
+
     def testClose(self):
         N = 100
         M = 100
-        counts = collections.defaultdict(int)
-        def accounting():
-            counts[thread.get_ident()] += 1
 
         for i in xrange(N):
-            counts.clear()
+            count = itertools.count().next
+            def accounting():
+                count()
             pool = ThreadPool(2)
             for j in xrange(M):
                 pool.apply_async(accounting)
             pool.close()
             pool.join()
-            total_counts = sum(counts.itervalues())
+            total_counts = count()
             self.assertEqual(total_counts, M)
 
     def testTerminate(self):
         N = 100
         M = 100
-        def accounting(counts):
-            counts[thread.get_ident()] += 1
+        def accounting(count):
+            count()
 
         for i in xrange(N):
-            counts = collections.defaultdict(int)
-            args = (counts,)
+            count = itertools.count().next
+            args = (count,)
             pool = ThreadPool(2)
             for j in xrange(M):
                 pool.apply_async(accounting, args)
             pool.terminate()
             pool.join()
-            total_counts = sum(counts.values())
+            total_counts = count()
             self.assertLessEqual(total_counts, M)
 
 class ThreadpoolSubqueueWrapperTest(ThreadpoolTest):
@@ -183,6 +301,71 @@ class ThreadpoolSubqueueWrapperTest(ThreadpoolTest):
     def tearDown(self):
         self.join_close(self.pool.pool, 60)
 
+class ShardedThreadpoolTest(ThreadpoolTest):
+    def setUp(self):
+        self.pool = ShardedThreadPool(4)
+
+    def testShardSpread(self):
+        # Threads submitting a single task each must not all land on the same shard
+        pool = self.pool
+        first_shards = []
+        def submitter():
+            first_shards.append(pool._shard())
+        for i in xrange(len(pool._shards)):
+            t = Thread(target=submitter)
+            t.start()
+            t.join()
+        self.assertEqual(len(set(map(id, first_shards))), len(pool._shards))
+
+    def testLocalIsForCallers(self):
+        # Shard selection must not leave its own state in the callers' local
+        self.pool._shard()
+        self.assertEqual(vars(self.pool.local), {})
+
+    def testWorkerNames(self):
+        pool = ShardedThreadPool(4, name_pattern = "worker-%d")
+        try:
+            names = []
+            def getname():
+                names.append(current_thread().name)
+            for shard in pool._shards:
+                shard.apply(getname)
+            self.assertEqual(len(set(names)), len(pool._shards))
+        finally:
+            self.join_close(pool, 60)
+
+class ShardedThreadpoolSubqueueWrapperTest(ThreadpoolTest):
+    def setUp(self):
+        self.pool = ShardedThreadPool(4).subqueue("something")
+
+    def tearDown(self):
+        self.join_close(self.pool.pool, 60)
+
+class PurePythonImportTest(TestCase):
+    def testImportWithoutCython(self):
+        # The annotation shim has to work when Cython isn't installed
+        import chorde.threadpool
+        path = os.path.splitext(chorde.threadpool.__file__)[0] + '.py'
+        modname = 'chorde._threadpool_nocython'
+        saved = sys.modules.get('cython', _MISSING)
+        sys.modules['cython'] = None # makes import cython raise ImportError
+        try:
+            mod = imp.load_source(modname, path)
+        finally:
+            sys.modules.pop(modname, None)
+            if saved is _MISSING:
+                del sys.modules['cython']
+            else:
+                sys.modules['cython'] = saved
+        self.assertIs(mod.cython, mod._cython)
+
+        pool = mod.ThreadPool(1)
+        try:
+            self.assertEqual(pool.apply(sum, ((1, 2),)), 3)
+        finally:
+            pool.close()
+            pool.join(60)
+
 class ThreadpoolMultiprocessingCompatiblitityTest(ThreadpoolTest):
     def setUp(self):
         self.pool = multiprocessing.pool.ThreadPool()
@@ -221,12 +404,14 @@ class MultiQueueTest(TestCase):
 
         terminate = []
         M = 50
-        counts = collections.defaultdict(int)
+        count = itertools.count().next
         def accounting(i):
-            counts[thread.get_ident()] += 1
+            count()
         def killit(i):
+            apply_async = self.pool.apply_async
+            args = (i,)
             while not terminate:
-                self.pool.apply_async(accounting, (i,))
+                apply_async(accounting, args)
                 time.sleep(0) # needed to avoid GIL issues that skew test results
         threads = [ Thread(target=killit, args=(i,)) for i in xrange(M) ]
         for t in threads:
@@ -236,7 +421,7 @@ class MultiQueueTest(TestCase):
         for t in threads:
             t.join()
         t0 = time.time()
-        self.pool.apply(sum, (counts.itervalues(),), queue = "Johnny")
+        self.pool.apply(count, queue = "Johnny")
         t1 = time.time()
         self.assertLess(t1-t0, 0.025)
 